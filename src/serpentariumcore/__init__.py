@@ -10,8 +10,10 @@ from .service_container import (
     ServiceContainer,
     ServiceDiscovery,
     ServiceNotRegistered,
+    ServiceOf,
     ServiceRegistration,
     ServiceRequiresOtherServiceWithIdenticalProtocol,
+    container,
     multi_register_as,
     register_as,
     resolve,
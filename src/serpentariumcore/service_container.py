@@ -1,22 +1,122 @@
+import contextlib
+import graphlib
 import importlib.util
 import inspect
 import logging
 import os
-import tempfile
+import sys
+import threading
 import time
-from inspect import getmembers, isfunction
+import types
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from importlib.machinery import ModuleSpec
 from pathlib import Path
-from typing import Any, Callable, Iterable, Protocol, Self, Tuple, Type
+from typing import Any, Callable, Generic, Iterable, Iterator, Protocol, Self, Tuple, Type, TypeVar, get_args, get_origin
+from weakref import WeakKeyDictionary
 
 logger = logging.getLogger("serpentariumcore")
 
+_Entry = Callable[[], Any]
+
+_ARGSPEC_CACHE: WeakKeyDictionary[Type, dict[str, Type]] = WeakKeyDictionary()
+_PLAN_CACHE: WeakKeyDictionary[Type, tuple[tuple[str, Type], ...]] = WeakKeyDictionary()
+_BUILDER_CACHE: WeakKeyDictionary[Type, Callable[..., Any]] = WeakKeyDictionary()
+_PROTOCOL_METHODS: WeakKeyDictionary[Type, frozenset[str]] = WeakKeyDictionary()
+
+# ServiceContainer(namespace=...) and set_namespace() change the process wide
+# namespace. Used in a with block, the switch is instead local to the current
+# thread or asyncio task until the block ends: the namespaces it replaced stay
+# pending until __enter__ takes the switch over.
+_scoped_namespace: ContextVar[str | None] = ContextVar(
+    "serpentariumcore_namespace", default=None
+)
+_scoped_pending: ContextVar[tuple[str, str | None] | None] = ContextVar(
+    "serpentariumcore_pending_namespace", default=None
+)
+_scoped_previous: ContextVar[tuple[tuple[str | None] | None, ...]] = ContextVar(
+    "serpentariumcore_previous_namespaces", default=()
+)
+_get_scoped_namespace = _scoped_namespace.get
+
+
+def _get_protocol_methods(protocol: Type) -> frozenset[str]:
+    methods = _PROTOCOL_METHODS.get(protocol)
+    if methods is None:
+        methods = frozenset(
+            name
+            for base in protocol.__mro__
+            for name, value in vars(base).items()
+            if callable(value) and not name.startswith("__")
+        )
+        _PROTOCOL_METHODS[protocol] = methods
+    return methods
+
 
 def implements_protocol(cls: Type, protocol: Type) -> bool:
-    cls_attrs = [name for name, _ in getmembers(cls, predicate=isfunction)]
-    protocol_attrs = [name for name, _ in getmembers(protocol, predicate=isfunction)]
-    return all(
-        attr in cls_attrs for attr in protocol_attrs if not attr.startswith("__")
-    )
+    return _get_protocol_methods(protocol).issubset(dir(cls))
+
+
+def _get_reqs(klass: Type) -> dict[str, Type]:
+    reqs = _ARGSPEC_CACHE.get(klass)
+    if reqs is None:
+        init = klass.__init__
+        reqs = {} if init is object.__init__ else getattr(init, "__annotations__", {})
+        if any(isinstance(proto, str) for proto in reqs.values()):
+            # Postponed annotations (PEP 563) have to be evaluated first.
+            reqs = inspect.get_annotations(init, eval_str=True)
+        reqs = dict(reqs)
+        _ARGSPEC_CACHE[klass] = reqs
+    return reqs
+
+
+def _get_plan(klass: Type) -> tuple[tuple[str, Type], ...]:
+    plan = _PLAN_CACHE.get(klass)
+    if plan is None:
+        plan = tuple(
+            (name, proto)
+            for name, proto in _get_reqs(klass).items()
+            if name != "return" and proto is not None
+        )
+        _PLAN_CACHE[klass] = plan
+    return plan
+
+
+def _compile_builder(
+    klass: Type, plan: tuple[tuple[str, Type], ...]
+) -> Callable[..., Any]:
+    # The generated function takes the class as an argument instead of closing
+    # over it, so the weak-keyed cache entry does not keep the class alive.
+    namespace: dict[str, Any] = {}
+    # Without extra arguments the dependencies are passed as plain keywords and
+    # no dict is built; otherwise they override the extra arguments.
+    keywords = []
+    entries = []
+    for i, (name, proto) in enumerate(plan):
+        namespace[f"_p{i}"] = proto
+        keywords.append(f"{name}=built[_p{i}]")
+        entries.append(f"{name!r}: built[_p{i}]")
+    lines = ["def build(klass, built, kwargs):"]
+    if plan:
+        lines += [
+            "    if not kwargs:",
+            f"        return klass({', '.join(keywords)})",
+            f"    return klass(**{{**kwargs, {', '.join(entries)}}})",
+        ]
+    else:
+        # Arguments from a ServiceArgument are passed on without a copy.
+        lines.append("    return klass(**kwargs)")
+    code = compile("\n".join(lines), f"<builder {klass.__qualname__}>", "exec")
+    exec(code, namespace)
+    return namespace["build"]  # type: ignore
+
+
+def _get_builder(klass: Type) -> Callable[..., Any]:
+    builder = _BUILDER_CACHE.get(klass)
+    if builder is None:
+        builder = _compile_builder(klass, _get_plan(klass))
+        _BUILDER_CACHE[klass] = builder
+    return builder
 
 
 class ServiceAlreadyRegistered(Exception):
@@ -46,12 +146,18 @@ class MissingRequirements(Exception):
         super().__init__(*args)
         self.klass = klass
         self.missing_requirements = missing_requirements
+        self.message = (
+            f"Service {klass} requires the following services which are not "
+            f"available: {', '.join(missing_requirements)}"
+        )
 
     def __str__(self) -> str:
-        return f"Service {self.klass} requires the following services which are not avaible: {", ".join(self.missing_requirements)}"  # noqa: F401 # pragma: no cover
+        return self.message
 
 
 class ServiceArgument:
+    __slots__ = ("klass", "kwargs")
+
     def __init__(self, **kwargs: dict[Any, Any]) -> None:
         self.klass = None
         self.kwargs = kwargs
@@ -64,210 +170,509 @@ class ServiceArgument:
         return self.klass, self.kwargs
 
 
+def _instance_entry(instance: Any) -> _Entry:
+    return lambda: instance
+
+
+class _Constructor:
+    # Builder for a class registered under lazy construction. Kept as its own
+    # type so construct() can recognise it and walk its dependencies. Unless it
+    # belongs to a factory registration, the instance it builds replaces it
+    # through the cache callback.
+    __slots__ = ("container", "protocol", "klass", "namespace", "kwargs", "cache")
+
+    def __init__(
+        self,
+        container: "ServiceContainer",
+        protocol: Type,
+        klass: Type,
+        namespace: str,
+        kwargs: dict[str, Any],
+        cache: Callable[[str, Type, Any], None] | None = None,
+    ) -> None:
+        self.container = container
+        self.protocol = protocol
+        self.klass = klass
+        self.namespace = namespace
+        self.kwargs = kwargs
+        self.cache = cache
+
+    def __call__(self) -> Any:
+        instance = self.container.construct(self.klass, self.namespace, **self.kwargs)
+        if self.cache is not None:
+            self.cache(self.namespace, self.protocol, instance)
+        return instance
+
+
 class ServiceContainer:
-    __default_namespace: str = "default"
-    __lazy_construction: bool | None = None
+    # Per-container settings live in slots; the registries are shared class
+    # attributes that are only ever mutated in place.
+    __slots__ = (
+        "__default_namespace",
+        "__lazy_construction",
+        "__lazy_effective",
+        "__current_namespace",
+        "__namespace_resolver",
+        "__cache_resolved_namespace",
+        "__resolved_namespace",
+        "__raise_exception_on_double_registrations",
+        "__check_namespace",
+    )
+
+    __default_namespace: str
+    __lazy_construction: bool | None
+    __lazy_effective: bool
+    __current_namespace: str
+    __namespace_resolver: Callable[[], str] | None
+    __cache_resolved_namespace: bool
+    __resolved_namespace: str | None
+    __raise_exception_on_double_registrations: bool
+    __check_namespace: Callable[[str | None], str]
     __instance = None
-    __services: dict[str, dict[Type, Type]] = {}
-    __multi_services: dict[Type, list[Type]] = {}
-    __current_namespace: str = __default_namespace
-    __previous_namespace: str | None = None
-    __namespace_resolver: Callable[[], str] | None = None
-    __raise_exception_on_double_registrations: bool = False
+    __services: dict[tuple[str, Type], _Entry] = {}
+    __factories: dict[tuple[str, Type], Callable[[dict[str, Any]], Any]] = {}
+    __resolved: dict[tuple[str, Type], Any] = {}
+    __shared: dict[tuple[Type, tuple[tuple[str, Any], ...]], Any] = {}
+    __multi_services: dict[Type, tuple[Type, ...]] = {}
 
     def __new__(cls, namespace: str | None = None, lazy_construction: bool | None = None):  # type: ignore # noqa: F401 # pragma: no cover
         if cls.__instance is None:
-            cls.__instance = super(ServiceContainer, cls).__new__(cls)
+            instance = super(ServiceContainer, cls).__new__(cls)
+            instance.__default_namespace = "default"
+            instance.__lazy_construction = None
+            instance.__lazy_effective = True
+            instance.__current_namespace = instance.__default_namespace
+            instance.__namespace_resolver = None
+            instance.__cache_resolved_namespace = False
+            instance.__resolved_namespace = None
+            instance.__raise_exception_on_double_registrations = False
+            instance.__check_namespace = instance.__check_namespace_fast
+            cls.__instance = instance
         return cls.__instance
 
     def __init__(
         self, namespace: str | None = None, lazy_construction: bool | None = None
     ) -> None:
+        if _scoped_pending.get() is not None:
+            _scoped_pending.set(None)
+        if namespace is None and lazy_construction is None:
+            return
+
         if namespace:
-            ns = self.__check_namespace(namespace)
-            self.set_namespace(ns)
+            pending = self.__current_namespace, _get_scoped_namespace()
+            self.set_namespace(namespace)
+            _scoped_pending.set(pending)
 
         if self.__lazy_construction is None and lazy_construction is not None:
             self.__lazy_construction = lazy_construction
+            self.__lazy_effective = lazy_construction
 
     def setconfig(self, values: dict[str, Any]) -> None:
         for attr, value in values.items():
-            if attr in ["instance", "services", "multi_services"]:
+            if attr in [
+                "instance",
+                "services",
+                "multi_services",
+                "factories",
+                "resolved",
+                "shared",
+                "lazy_effective",
+            ]:
                 continue
             if hasattr(
                 self, f"_ServiceContainer__{attr}"
             ):  # noqa: F401 # pragma: no cover
                 setattr(self, f"_ServiceContainer__{attr}", value)
+        self.__lazy_effective = self.__lazy_construction in (True, None)
+        self.__bind_namespace_check()
 
-    def __check_namespace(self, namespace: str | None = None) -> str:
+    def __check_namespace_fast(self, namespace: str | None = None) -> str:
+        return namespace or _get_scoped_namespace() or self.__current_namespace
+
+    def __check_namespace_with_resolver(self, namespace: str | None = None) -> str:
         if not namespace and self.__namespace_resolver:
             namespace = self.__namespace_resolver()
-        ns = namespace or self.__current_namespace
-        if ns not in self.__services:
-            self.__services[ns] = {}
-        return ns
+        return namespace or _get_scoped_namespace() or self.__current_namespace
+
+    def __check_namespace_with_cached_resolver(
+        self, namespace: str | None = None
+    ) -> str:
+        if not namespace:
+            namespace = self.__resolved_namespace
+            if namespace is None:
+                namespace = self.__namespace_resolver() or ""  # type: ignore
+                self.__resolved_namespace = namespace
+        return namespace or _get_scoped_namespace() or self.__current_namespace
+
+    def __bind_namespace_check(self) -> None:
+        # Only pay for the resolver lookup while a resolver is actually set.
+        self.__resolved_namespace = None
+        if self.__namespace_resolver and self.__cache_resolved_namespace:
+            self.__check_namespace = self.__check_namespace_with_cached_resolver
+        elif self.__namespace_resolver:
+            self.__check_namespace = self.__check_namespace_with_resolver
+        else:
+            self.__check_namespace = self.__check_namespace_fast
 
     def construct(
-        self, klass: Type, namespace: str | None = None, **kwargs: dict[Any, Any]
-    ) -> Type[Any]:
-        if not inspect.isclass(klass):  # noqa: F401 # pragma: no cover
+        self, klass: Any, namespace: str | None = None, **kwargs: dict[Any, Any]
+    ) -> Any:
+        if not isinstance(klass, type):  # noqa: F401 # pragma: no cover
             return klass
 
+        if not kwargs and klass.__init__ is object.__init__:  # type: ignore[misc]
+            return klass()
+
+        plan = _get_plan(klass)
+        if not plan and not kwargs:
+            return klass()
+
         ns = self.__check_namespace(namespace)
-        klass_contstructor_args = inspect.getfullargspec(klass.__init__)
-        reqs = {
-            var_name: proto
-            for var_name, proto in klass_contstructor_args.annotations.items()
-        }
-
-        params: dict[Any, Any] = {}
-        params.update(kwargs)
-        missing_requirements = []
-        for k, v in reqs.items():
-            if v in self.__services[ns]:
-                inst = self.__services[ns][v]
-                if inspect.isclass(inst):  # noqa: F401 # pragma: no cover
-                    inst = self.construct(inst, ns)
-                params[k] = inst
-            elif v:
-                missing_requirements.append(v.__name__)
-
-        if missing_requirements:
-            raise MissingRequirements(klass.__name__, missing_requirements)
-
-        return klass(**params)  # type: ignore
+        factory = self.__factories.get((ns, klass))
+        if factory is None:
+            factory = self.__make_factory(klass, ns)
+            self.__factories[ns, klass] = factory
+        return factory(kwargs)
+
+    def __make_factory(self, klass: Type, ns: str) -> Callable[[dict[str, Any]], Any]:
+        # Binds everything construct() needs for klass in this namespace. The
+        # factory is dropped whenever the registrations it was built from change.
+        order = self.__compute_build_order(klass, ns)
+        builder = _get_builder(klass)
+        services = self.__services
+
+        def factory(kwargs: dict[str, Any]) -> Any:
+            built: dict[Type, Any] = {}
+            for proto in order:
+                entry = services[ns, proto]
+                if type(entry) is _Constructor:
+                    dependency = entry.klass
+                    built[proto] = _get_builder(dependency)(
+                        dependency, built, entry.kwargs
+                    )
+                    if entry.cache is not None:
+                        entry.cache(ns, proto, built[proto])
+                else:
+                    built[proto] = entry()
+            return builder(klass, built, kwargs)
+
+        return factory
+
+    def __compute_build_order(self, klass: Type, ns: str) -> tuple[Type, ...]:
+        graph: dict[Type, tuple[Type, ...]] = {}
+        pending: list[tuple[Type, Type | None]] = [(klass, None)]
+        while pending:
+            current, proto = pending.pop()
+            deps = tuple(dep for _, dep in _get_plan(current))
+            missing_requirements = [
+                dep.__name__ for dep in deps if (ns, dep) not in self.__services
+            ]
+            if missing_requirements:
+                raise MissingRequirements(current.__name__, missing_requirements)
+            if proto is not None:
+                graph[proto] = deps
+            for dep in deps:
+                if dep in graph:
+                    continue
+                entry = self.__services[ns, dep]
+                if type(entry) is _Constructor:
+                    pending.append((entry.klass, dep))
+                else:
+                    graph[dep] = ()
+        try:
+            return tuple(graphlib.TopologicalSorter(graph).static_order())
+        except graphlib.CycleError as ex:
+            raise ConstructionFailed(
+                f"Circular dependency while constructing {klass.__name__}: "
+                f"{' -> '.join(proto.__name__ for proto in ex.args[1])}"
+            ) from None
 
     def register(
         self, klass: Type, instance: Type, namespace: str | None = None
     ) -> None:
-        ns = self.__check_namespace(namespace)
-        if not self.lazy_construction and inspect.isclass(instance):
-            instance = self.construct(instance, ns)
+        self.__register(klass, instance, namespace, singleton=True)
+
+    def register_factory(
+        self, klass: Type, instance: Type, namespace: str | None = None
+    ) -> None:
+        "Like register, but every resolve constructs a new instance."
+        self.__register(klass, instance, namespace, singleton=False)
 
-        if (
-            self.__raise_exception_on_double_registrations
-            and klass in self.__services[ns]
-        ):
+    def register_cached(
+        self, klass: Type, instance: Type, namespace: str | None = None, **kwargs: Any
+    ) -> None:
+        "Register one shared instance per service class and (hashable) kwargs."
+        key = instance, tuple(sorted(kwargs.items()))
+        shared = self.__shared.get(key)
+        if shared is None:
+            shared = instance(**kwargs)
+            self.__shared[key] = shared
+        self.__register(klass, shared, namespace, singleton=True)
+
+    def __register(
+        self, klass: Type, instance: Type, namespace: str | None, singleton: bool
+    ) -> None:
+        ns = sys.intern(self.__check_namespace(namespace))
+        services = self.__services
+        if self.__raise_exception_on_double_registrations and (ns, klass) in services:
             raise ServiceAlreadyRegistered(f"Service {klass} is already registered.")
-        self.__services[ns][klass] = instance
+
+        services[ns, klass] = self.__make_entry(klass, instance, ns, singleton)
+        self.__resolved.pop((ns, klass), None)
+        self.__factories.clear()
+
+    def __make_entry(
+        self, klass: Type, instance: Any, ns: str, singleton: bool = True
+    ) -> _Entry:
+        # Every registration is stored as a callable taking no arguments so
+        # resolve() never has to inspect what kind of value was registered.
+        kwargs: dict[str, Any] = {}
+        if isinstance(instance, ServiceArgument):
+            instance, kwargs = instance.unwrap()
+        if isinstance(instance, type):
+            if self.__lazy_effective or not singleton:
+                cache = self.__cache_instance if singleton else None
+                return _Constructor(self, klass, instance, ns, kwargs, cache)
+            instance = self.construct(instance, ns, **kwargs)
+        return _instance_entry(instance)
+
+    def __cache_instance(self, ns: str, klass: Type, instance: Any) -> None:
+        self.__services[ns, klass] = _instance_entry(instance)
+        self.__resolved[ns, klass] = instance
+        # Cached factories may still walk the dependencies of the now built service.
+        self.__factories.clear()
 
     def multi_register(self, klass: Type, instance: Type) -> None:
         assert implements_protocol(instance, klass)
-        if klass in self.__multi_services:
-            if instance in self.__multi_services[klass]:
-                return
+        services = self.__multi_services.get(klass, ())
+        if instance in services:
+            return
 
-        self.__multi_services.setdefault(klass, []).append(instance)
+        # Stored as a new tuple so resolve_multi() iterates over a stable snapshot.
+        self.__multi_services[klass] = services + (instance,)
 
-        klass_contstructor_args = inspect.getfullargspec(instance.__init__)
-        reqs = [proto for _, proto in klass_contstructor_args.annotations.items()]
-        if klass in reqs:
+        if klass in _get_reqs(instance).values():
             raise ServiceRequiresOtherServiceWithIdenticalProtocol(instance)
 
     def resolve_multi(self, klass: Type) -> Iterable[Type]:
-        for service in self.__multi_services.get(klass, []):
+        for service in self.__multi_services.get(klass, ()):
             yield self.construct(service)
 
     def replace(
         self, klass: Type, instance: Type, namespace: str | None = None
     ) -> None:
-        ns = self.__check_namespace(namespace)
-        self.__services[ns][klass] = instance
+        ns = sys.intern(self.__check_namespace(namespace))
+        self.__services[ns, klass] = self.__make_entry(klass, instance, ns)
+        self.__resolved.pop((ns, klass), None)
+        self.__factories.clear()
 
     def resolve(self, klass: Type, namespace: str | None = None) -> Type | None:
+        key = self.__check_namespace(namespace), klass
+        item: Type | None = self.__resolved.get(key)
+        if item is not None:
+            return item
+        entry = self.__services.get(key)
+        if entry is None:
+            return None
+        item = entry()
+        if type(entry) is not _Constructor:
+            # Registered instances never change, so later resolves skip the call.
+            self.__resolved[key] = item
+        return item
+
+    def resolver_for(
+        self, klass: Type, namespace: str | None = None
+    ) -> Callable[[], Any]:
+        "Bind the namespace once and return a callable resolving klass in it."
+        ns = sys.intern(self.__check_namespace(namespace))
+        key = ns, klass
+        resolved = self.__resolved
+        resolve = self.resolve
+
+        def resolver() -> Any:
+            item = resolved.get(key)
+            return item if item is not None else resolve(klass, ns)
+
+        return resolver
+
+    def remove(self, klass: Any, namespace: str | None = None) -> None:
         ns = self.__check_namespace(namespace)
-        if klass in self.__services[ns]:
-            item = self.__services[ns][klass]
-            kwargs: dict[Any, Any] = {}
-            if isinstance(item, ServiceArgument):
-                inner_klass, kwargs = item.unwrap()  # type: ignore
-                item = inner_klass
-            if self.lazy_construction and inspect.isclass(item):
-                item = self.construct(item, ns, **kwargs)
-
-            return item  # noqa: F401 # pragma: no cover
-        return None
-
-    def remove(self, klass: Type, namespace: str | None = None) -> None:
-        ns = self.__check_namespace(namespace)
-        if not inspect.isclass(klass):
+        if not isinstance(klass, type):
             klass = klass.__class__
-        if klass in self.__services[ns]:  # pragma: no cover
-            del self.__services[ns][klass]
+        if self.__services.pop((ns, klass), None) is not None:  # pragma: no cover
+            self.__resolved.pop((ns, klass), None)
+            self.__factories.clear()
 
     def clear(self) -> None:
         self.__services.clear()
+        self.__resolved.clear()
+        self.__shared.clear()
+        self.__factories.clear()
         self.__current_namespace = self.__default_namespace
-        self.__previous_namespace = None
+        _scoped_namespace.set(None)
+        _scoped_pending.set(None)
+        _scoped_previous.set(())
         self.__lazy_construction = None
+        self.__lazy_effective = True
 
     def set_namespace(self, namespace: str) -> None:
-        self.__previous_namespace = self.__current_namespace
-        self.__current_namespace = namespace
+        "Namespaces are interned; short literal names keep lookups cheap."
+        self.__current_namespace = sys.intern(namespace)
+        # An explicit switch also wins over a with block in this context.
+        if _get_scoped_namespace() is not None:
+            _scoped_namespace.set(None)
+        if _scoped_pending.get() is not None:
+            _scoped_pending.set(None)
 
     def __enter__(self) -> Self:
+        # Take over the switch made by ServiceContainer(namespace=...) in this
+        # with statement and make it local to the block. A block without a
+        # namespace has nothing to undo.
+        pending = _scoped_pending.get()
+        if pending is None:
+            _scoped_previous.set(_scoped_previous.get() + (None,))
+            return self
+        _scoped_pending.set(None)
+        current, scoped = pending
+        _scoped_namespace.set(self.__current_namespace)
+        self.__current_namespace = current
+        _scoped_previous.set(_scoped_previous.get() + ((scoped,),))
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):  # type: ignore
-        if self.__previous_namespace:  # noqa: F401 # pragma: no cover
-            self.__current_namespace = self.__previous_namespace
-        self.__previous_namespace = None
-
-    def set_namespace_resolver(self, func: Callable[[], str]) -> None:
+        previous = _scoped_previous.get()
+        if previous:  # noqa: F401 # pragma: no cover
+            _scoped_previous.set(previous[:-1])
+            if previous[-1] is not None:
+                _scoped_namespace.set(previous[-1][0])
+
+    @contextlib.contextmanager
+    def scoped(self, namespace: str) -> Iterator[Self]:
+        "Use namespace in this thread or task until the with block ends."
+        previous = _get_scoped_namespace()
+        _scoped_namespace.set(sys.intern(namespace))
+        try:
+            yield self
+        finally:
+            _scoped_namespace.set(previous)
+
+    def set_namespace_resolver(
+        self, func: Callable[[], str], cache: bool = False
+    ) -> None:
+        "With cache=True func is only called again after bump_resolver_epoch()."
         self.__namespace_resolver = func
+        self.__cache_resolved_namespace = cache
+        self.__bind_namespace_check()
 
     def clear_namespace_resolver(self) -> None:
         self.__namespace_resolver = None
+        self.__cache_resolved_namespace = False
+        self.__bind_namespace_check()
+
+    def bump_resolver_epoch(self) -> None:
+        "Forget the cached resolver result, e.g. at the start of each request."
+        self.__resolved_namespace = None
 
     @property
     def lazy_construction(self) -> bool:
-        return self.__lazy_construction in [True, None]
+        return self.__lazy_effective
 
     @property
     def namespace(self) -> str:
         if self.__namespace_resolver:
-            return self.__namespace_resolver()
-        return self.__current_namespace
+            return self.__check_namespace(None)
+        return _get_scoped_namespace() or self.__current_namespace
+
+    def _clear_reflection_cache(self) -> None:
+        "Forget cached constructor annotations, e.g. after patching a class in tests."
+        _ARGSPEC_CACHE.clear()
+        _PLAN_CACHE.clear()
+        _BUILDER_CACHE.clear()
+        _PROTOCOL_METHODS.clear()
+        self.__factories.clear()
+
+    def warmup(self, namespace: str | None = None) -> None:
+        "Construct every lazily registered singleton in the namespace up front."
+        ns = self.__check_namespace(namespace)
+        graph: dict[Type, tuple[Type, ...]] = {}
+        for (entry_ns, proto), entry in self.__services.items():
+            if entry_ns == ns and type(entry) is _Constructor:
+                graph[proto] = tuple(dep for _, dep in _get_plan(entry.klass))
+        try:
+            order = tuple(graphlib.TopologicalSorter(graph).static_order())
+        except graphlib.CycleError as ex:
+            raise ConstructionFailed(
+                f"Circular dependency while warming up {ns}: "
+                f"{' -> '.join(proto.__name__ for proto in ex.args[1])}"
+            ) from None
+        # Dependencies come first, so every service is built from cached instances.
+        for proto in order:
+            service = self.__services.get((ns, proto))
+            if type(service) is _Constructor and service.cache is not None:
+                service()
 
     def sanity_check(self) -> bool:
-        for ns in self.__services:
-            for proto in self.__services[ns]:
-                self.resolve(proto, ns)
+        # Validates the dependency graph of every lazily constructed service
+        # without calling any constructors.
+        for (ns, _), entry in self.__services.items():
+            if (
+                type(entry) is _Constructor
+                and (ns, entry.klass) not in self.__factories
+            ):
+                self.__factories[ns, entry.klass] = self.__make_factory(entry.klass, ns)
         return True
 
 
+# The shortcuts below use this directly instead of calling ServiceContainer() and
+# going through __new__ and __init__ every time. Applications can import it too.
+container = ServiceContainer()
+
+
 class ServiceRegistration:
-    def __init__(self, klass: Type, namespace: str | None = None):
+    __slots__ = (
+        "klass",
+        "namespace",
+        "args",
+        "kwargs",
+        "service_arguments",
+        "transient",
+    )
+
+    def __init__(
+        self, klass: Type, namespace: str | None = None, transient: bool = False
+    ):
         self.klass = klass
         self.namespace = namespace
         self.args: Tuple = ()
         self.kwargs: dict[Any, Any] = {}
         self.service_arguments: ServiceArgument | None = None
+        self.transient = transient
 
     def with_arguments(self, service_arguments: Type[ServiceArgument]) -> Self:
         self.service_arguments = service_arguments  # type: ignore
         return self
 
     def __call__(self, instance: Type) -> Type:
+        register = container.register_factory if self.transient else container.register
         if self.service_arguments is not None:
             self.service_arguments.for_service(instance)
-            ServiceContainer().register(self.klass, self.service_arguments, namespace=self.namespace)  # type: ignore
+            register(self.klass, self.service_arguments, namespace=self.namespace)  # type: ignore
         else:
-            ServiceContainer().register(self.klass, instance, namespace=self.namespace)
-            logger.info(f"Service container registered {self.klass} -> {instance}")
+            register(self.klass, instance, namespace=self.namespace)
+            logger.info("Service container registered %s -> %s", self.klass, instance)
         return instance
 
 
 def resolve(klass: Type, namespace: str | None = None) -> Type | None:
     "Shortcut for ServiceContainer().resolve(...)"
-    return ServiceContainer().resolve(klass, namespace)
+    return container.resolve(klass, namespace)
 
 
 def register_as(klass: Type, namespace: str | None = None) -> Callable[[Type], Type]:
     "Shortcut for ServiceRegistration(...)"
 
     def decorator(cls: Type) -> Type:
-        ServiceContainer().register(klass, cls, namespace=namespace)
+        container.register(klass, cls, namespace=namespace)
         return cls
 
     return decorator
@@ -275,33 +680,89 @@ def register_as(klass: Type, namespace: str | None = None) -> Callable[[Type], T
 
 def multi_register_as(klass: Type) -> Callable[[Type], Type]:
     def decorator(cls: Type) -> Type:
-        ServiceContainer().multi_register(klass, cls)
+        container.multi_register(klass, cls)
         return cls
 
     return decorator
 
 
 def resolve_multi(klass: Type) -> Iterable[Type]:
-    return ServiceContainer().resolve_multi(klass)
+    return container.resolve_multi(klass)
+
+
+P = TypeVar("P")
 
 
-def import_module_from_file(file_path: Path) -> Any:
+class ServiceOf(Generic[P]):
+    "Base class alternative to register_as: class A(ServiceOf[IA], namespace=...)"
+
+    __slots__ = ()
+
+    def __init_subclass__(cls, namespace: str | None = None, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        # Subclasses of a registered service do not register themselves again.
+        for base in types.get_original_bases(cls):
+            if get_origin(base) is ServiceOf:
+                container.register(get_args(base)[0], cls, namespace=namespace)
+
+
+def load_module_code(
+    file_path: Path, module_name: str | None = None
+) -> Tuple[ModuleSpec, Any]:
     # Get the module name from the file name
-    module_name = file_path.stem
+    module_name = module_name or file_path.stem
 
-    # Load the module from the file
+    # Read and compile the module, using the bytecode cache when it is fresh
     spec = importlib.util.spec_from_file_location(module_name, file_path)
-    module = importlib.util.module_from_spec(spec)  # type: ignore
-    spec.loader.exec_module(module)  # type: ignore
-
+    code = spec.loader.get_code(module_name)  # type: ignore
+    return spec, code  # type: ignore
+
+
+def exec_module_code(
+    spec: ModuleSpec, code: Any, add_to_sys_modules: bool = False
+) -> Any:
+    module = importlib.util.module_from_spec(spec)
+    if not add_to_sys_modules:
+        exec(code, module.__dict__)
+        return module
+
+    # Like a regular import, the module is visible in sys.modules while it runs,
+    # is taken out again if it fails and is bound on its parent package.
+    sys.modules[spec.name] = module
+    try:
+        exec(code, module.__dict__)
+    except BaseException:
+        sys.modules.pop(spec.name, None)
+        raise
+    parent, _, child = spec.name.rpartition(".")
+    if parent in sys.modules:
+        setattr(sys.modules[parent], child, module)
     return module
 
 
+def import_module_from_file(file_path: Path, module_name: str | None = None) -> Any:
+    # Only modules with a qualified name are registered in sys.modules, a bare
+    # file stem could shadow an unrelated top-level module.
+    if module_name is None:
+        return exec_module_code(*load_module_code(file_path))
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    return exec_module_code(
+        *load_module_code(file_path, module_name), add_to_sys_modules=True
+    )
+
+
+def qualified_module_name(root: Path, package: str | None, file_path: Path) -> str:
+    parts = file_path.relative_to(root).with_suffix("").parts
+    return ".".join((package, *parts) if package else parts)
+
+
 class ServiceDiscovery:
     __instance = None
     __verbose: bool = True
-    __PID_FILE = "sd5435435345.pid"
     __discovered = []
+    __discovering: bool = False
+    __lock = threading.Lock()
 
     def __new__(cls, verbose: bool = True) -> Self:  # type: ignore # noqa: F401 # pragma: no cover
         if cls.__instance is None:
@@ -310,42 +771,62 @@ class ServiceDiscovery:
 
     def __init__(self, verbose: bool = True) -> None:
         self.__verbose = verbose
-        if not self.__discovered and os.path.exists(self.get_pid_file()):
-            os.remove(self.get_pid_file())
 
-    def log(self, msg: str) -> None:
+    def log(self, msg: str, *args: Any) -> None:
         if self.__verbose:
-            print(msg)
+            print(msg % args if args else msg)
         else:
-            logger.info(msg)
-
-    def get_pid_file(self) -> str:
-        temp_dir = tempfile.gettempdir()
-        return os.path.join(temp_dir, self.__PID_FILE)
+            logger.info(msg, *args)
 
     def discover(self, module: Any) -> None:
-        pid = self.get_pid_file()
-        if os.path.exists(pid) or module in self.__discovered:
-            return
+        # Modules imported during discovery may trigger discovery themselves.
+        with self.__lock:
+            if self.__discovering or module in self.__discovered:
+                return
+            self.__discovering = True
+            self.__discovered.append(module)
 
-        with open(pid, "w") as f:
-            f.write("0")
+        try:
+            self.__discover(module)
+        finally:
+            self.__discovering = False
 
-        self.__discovered.append(module)
+    def __discover(self, module: Any) -> None:
         start = time.time()
         self.log("Starting service discovery ...")
-        for unit in Path(module.__file__).parent.glob("**/*.py"):
+        root = Path(module.__file__).parent
+        # Modules that are already imported have registered their services, so
+        # they are skipped instead of being executed a second time. Only modules
+        # inside a package are registered in sys.modules, the bare name of a
+        # top-level file could shadow an unrelated module.
+        package = module.__package__
+        units: list[tuple[Path, str | None]] = []
+        for unit in root.glob("**/*.py"):
             if unit.name.startswith("test_") or unit.name.startswith("__"):
                 continue
-            try:
-                import_module_from_file(unit)
-            except Exception as ex:
-                self.log(f"Error importing {unit}: {ex}")
-
-        if os.path.exists(pid):
-            os.remove(pid)
-
-        self.log(f"Finished discovery in {time.time()-start} seconds.")
+            name = qualified_module_name(root, package, unit) if package else None
+            if name is None or name not in sys.modules:
+                units.append((unit, name))
+        # Reading and compiling the modules is independent work and runs on a
+        # thread pool. Executing them, and with that registering their services,
+        # stays serial and in discovery order so registrations are predictable.
+        workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(load_module_code, unit, name) for unit, name in units
+            ]
+            for (unit, name), future in zip(units, futures):
+                try:
+                    if name is None:
+                        exec_module_code(*future.result())
+                    elif name not in sys.modules:
+                        # Subpackages are imported first, as a regular import would.
+                        importlib.import_module(name.rpartition(".")[0])
+                        exec_module_code(*future.result(), add_to_sys_modules=True)
+                except Exception as ex:
+                    self.log("Error importing %s: %s", unit, ex)
+
+        self.log("Finished discovery in %s seconds.", time.time() - start)
 
     def __enter__(self) -> Self:
         return self
@@ -0,0 +1,32 @@
+from typing import Protocol
+
+import pytest
+from serpentariumcore import container
+
+
+class TheTalkingProtocol(Protocol):
+    def speak(self, sentence) -> str: ...
+
+
+class Speaker:
+    def speak(self, sentence) -> str:
+        return f"The speaker says '{sentence}'."
+
+
+class Teacher:
+    def speak(self, sentence) -> str:
+        return f"The teacher screams '{sentence}'."
+
+
+class Substitute:
+    def speak(self, sentence) -> str:
+        return f"The substitute mumbles '{sentence}'."
+
+
+@pytest.fixture(autouse=True)
+def clean_container():
+    # Registrations made at import time through multi_register_as are kept.
+    container.clear()
+    yield container
+    container.clear_namespace_resolver()
+    container.setconfig({"raise_exception_on_double_registrations": False})
@@ -11,8 +11,6 @@ from serpentariumcore import (
 
 
 def test_multi_service_registration_lazy_construction():
-    ServiceContainer().clear()
-
     class IB(Protocol):
         def generate(self) -> int: ...
 
@@ -52,8 +50,6 @@ def test_multi_service_registration_lazy_construction():
 
 
 def test_multi_service_registration_crashes_if_one_multi_service_requires_another_multi_service():
-    ServiceContainer().clear()
-
     class IB(Protocol):
         def generate(self) -> int: ...
 
@@ -87,8 +83,6 @@ def test_multi_service_registration_crashes_if_one_multi_service_requires_anothe
 
 
 def test_multi_service_over_and_over_does_not_give_duplicates():
-    ServiceContainer().clear()
-
     class IB(Protocol):
         def generate(self) -> int: ...
 
@@ -1,7 +1,7 @@
 from typing import Protocol
 
 import pytest
-from serpentariumcore import MissingRequirements, ServiceContainer
+from serpentariumcore import ConstructionFailed, MissingRequirements, ServiceContainer
 
 
 class IA(Protocol):
@@ -45,44 +45,157 @@ class C:
 
 
 def test_dynamic_object_construction():
-    ServiceContainer().clear()
-    ServiceContainer().register(IA, A)
-    ServiceContainer().register(IB, B)
-    ServiceContainer().register(IC, C)
-    if c := ServiceContainer().resolve(IC):
+    sc = ServiceContainer()
+    sc.register(IA, A)
+    sc.register(IB, B)
+    sc.register(IC, C)
+    if c := sc.resolve(IC):
         assert c.go_c() is not None
 
 
 def test_dynamic_object_construction_missing_requirement():
-    ServiceContainer().clear()
-    ServiceContainer().register(IA, A)
-    ServiceContainer().register(IC, C)
+    sc = ServiceContainer()
+    sc.register(IA, A)
+    sc.register(IC, C)
     # Not registering the IB service, which service C requires
-    with pytest.raises(MissingRequirements):
-        ServiceContainer().resolve(IC)
+    with pytest.raises(MissingRequirements, match="not available: IB"):
+        sc.resolve(IC)
 
 
 def test_dynamic_object_construction_lazy_construction():
-    ServiceContainer().clear()
-    ServiceContainer().register(IA, A)
-    ServiceContainer().register(IC, C)
-    ServiceContainer().register(IB, B)
+    sc = ServiceContainer()
+    sc.register(IA, A)
+    sc.register(IC, C)
+    sc.register(IB, B)
     # Registering IC before IB, even if IB requires IC to be registered
     # Lazy constructions should not cause this to
-    assert ServiceContainer().resolve(IC) != None
+    assert sc.resolve(IC) != None
 
 
 def test_sanity_check_success():
-    ServiceContainer().clear()
-    ServiceContainer().register(IA, A)
-    ServiceContainer().register(IC, C)
-    ServiceContainer().register(IB, B)
-    assert ServiceContainer().sanity_check() == True
+    sc = ServiceContainer()
+    sc.register(IA, A)
+    sc.register(IC, C)
+    sc.register(IB, B)
+    assert sc.sanity_check() == True
 
 
 def test_sanity_check_fails():
-    ServiceContainer().clear()
-    ServiceContainer().register(IC, C)
-    ServiceContainer().register(IB, B)
+    sc = ServiceContainer()
+    sc.register(IC, C)
+    sc.register(IB, B)
+    with pytest.raises(MissingRequirements):
+        assert sc.sanity_check()
+
+
+def test_warmup_constructs_singletons_once():
+    sc = ServiceContainer()
+    sc.register(IC, C)
+    sc.register(IB, B)
+    sc.register(IA, A)
+    sc.warmup()
+    c = sc.resolve(IC)
+    assert c.a is sc.resolve(IA)
+    assert c.b is sc.resolve(IB)
+    assert c.b.a is c.a
+
+
+def test_warmup_fails_on_missing_requirements():
+    sc = ServiceContainer()
+    sc.register(IC, C)
+    sc.register(IB, B)
     with pytest.raises(MissingRequirements):
-        assert ServiceContainer().sanity_check()
+        sc.warmup()
+
+
+def test_circular_dependency_fails():
+    class ID(Protocol):
+        def go_d(self): ...
+
+    class D:
+        # Requires a service that requires D itself
+        def __init__(self, b: IB):
+            self.b = b
+
+        def go_d(self):
+            return "Go D!"
+
+    class E:
+        def __init__(self, d: ID):
+            self.d = d
+
+        def go_b(self):
+            return "Go E!"
+
+    sc = ServiceContainer()
+    sc.register(ID, D)
+    sc.register(IB, E)
+    with pytest.raises(ConstructionFailed):
+        sc.resolve(ID)
+
+
+def test_sanity_check_does_not_construct_services():
+    constructed = []
+
+    class Tracked(A):
+        def __init__(self):
+            constructed.append(self)
+
+    sc = ServiceContainer()
+    sc.register(IA, Tracked)
+    sc.register(IB, B)
+    sc.register(IC, C)
+    assert sc.sanity_check()
+    assert constructed == []
+
+
+def test_lazy_construction_resolves_singletons():
+    sc = ServiceContainer()
+    sc.register(IA, A)
+    sc.register(IB, B)
+    sc.register(IC, C)
+    c = sc.resolve(IC)
+    assert sc.resolve(IC) is c
+    assert sc.resolve(IA) is c.a
+    assert sc.resolve(IB) is c.b
+
+
+def test_factory_registration_constructs_on_every_resolve():
+    sc = ServiceContainer()
+    sc.register(IA, A)
+    sc.register_factory(IB, B)
+    b = sc.resolve(IB)
+    assert sc.resolve(IB) is not b
+    assert sc.resolve(IB).a is b.a
+
+
+def test_clear_reflection_cache():
+    class D:
+        def __init__(self, a: IA):
+            self.a = a
+
+    sc = ServiceContainer()
+    sc.register(IA, A)
+    assert isinstance(sc.construct(D).a, A)
+
+    def __init__(self, b: IB):
+        self.b = b
+
+    D.__init__ = __init__
+    sc._clear_reflection_cache()
+    with pytest.raises(MissingRequirements):
+        sc.construct(D)
+
+
+def test_string_annotations_are_resolved():
+    class LateB:
+        def __init__(self, a: "IA"):
+            self.a = a
+
+        def go_b(self):
+            return self.a.go_a()
+
+    sc = ServiceContainer()
+    sc.register(IA, A)
+    sc.register(IB, LateB)
+    assert sc.resolve(IB).go_b() == "Go A!"
@@ -1,3 +1,4 @@
+import threading
 from typing import Callable, Protocol, Tuple
 
 import pytest
@@ -6,37 +7,27 @@ from serpentariumcore import (
     ServiceArgument,
     ServiceContainer,
     ServiceRegistration,
+    container,
     register_as,
     resolve,
 )
 
+from .conftest import Speaker, Substitute, Teacher, TheTalkingProtocol
 
-class TheTalkingProtocol(Protocol):
-    def speak(self, sentence) -> str: ...
 
+class LoggingBase(Protocol):
+    def log(self, msg: str) -> None: ...
 
-class Speaker:
-    def speak(self, sentence) -> str:
-        return f"The speaker says '{sentence}'."
 
-
-class Teacher:
-    def speak(self, sentence) -> str:
-        return f"The teacher screams '{sentence}'."
-
-
-class Substitute:
-    def speak(self, sentence) -> str:
-        return f"The substitute mumbles '{sentence}'."
+class FancyLoggingBase(Protocol):
+    def log(self, msg: str, func: Callable[[str], str]) -> str: ...
 
 
 class DummyWrapping(ServiceArgument):
-    pass
+    __slots__ = ()
 
 
 def test_teacher_using_both_shortcuts():
-    ServiceContainer().clear()
-
     @register_as(TheTalkingProtocol)
     class HeadMaster:
         def speak(self, sentence) -> str:
@@ -50,7 +41,6 @@ def test_teacher_using_both_shortcuts():
 
 
 def test_teacher_using_shortcut():
-    ServiceContainer().clear()
     ServiceContainer().register(TheTalkingProtocol, Teacher())
 
     if person := resolve(TheTalkingProtocol):
@@ -61,10 +51,10 @@ def test_teacher_using_shortcut():
 
 
 def test_teacher():
-    ServiceContainer().clear()
-    ServiceContainer().register(TheTalkingProtocol, Teacher())
+    sc = ServiceContainer()
+    sc.register(TheTalkingProtocol, Teacher())
 
-    if person := ServiceContainer().resolve(TheTalkingProtocol):
+    if person := sc.resolve(TheTalkingProtocol):
         assert (
             person.speak(sentence="The dog sits on a mat")
             == "The teacher screams 'The dog sits on a mat'."
@@ -72,10 +62,10 @@ def test_teacher():
 
 
 def test_speaker():
-    ServiceContainer().clear()
-    ServiceContainer().register(TheTalkingProtocol, Speaker())
+    sc = ServiceContainer()
+    sc.register(TheTalkingProtocol, Speaker())
 
-    if person := ServiceContainer().resolve(TheTalkingProtocol):
+    if person := sc.resolve(TheTalkingProtocol):
         assert (
             person.speak(sentence="The dog sits on a mat")
             == "The speaker says 'The dog sits on a mat'."
@@ -84,7 +74,6 @@ def test_speaker():
 
 def test_namespace():
     s = ServiceContainer()
-    s.clear()
     assert s.namespace == "default"
     s.set_namespace("test")
     assert s.namespace == "test"
@@ -94,27 +83,90 @@ def test_namespace():
     assert s.namespace == "test"
 
 
+def test_namespace_blocks_are_local_to_the_thread():
+    seen = []
+    s = ServiceContainer()
+    with ServiceContainer(namespace="prod"):
+        with ServiceContainer(namespace="debug"):
+            thread = threading.Thread(target=lambda: seen.append(s.namespace))
+            thread.start()
+            thread.join()
+            assert s.namespace == "debug"
+        assert s.namespace == "prod"
+    assert s.namespace == "default"
+    assert seen == ["default"]
+
+
+def test_namespace_blocks_without_a_namespace_keep_the_outer_one():
+    with ServiceContainer("prod"):
+        with ServiceContainer() as s:
+            pass
+        assert s.namespace == "prod"
+    assert s.namespace == "default"
+
+
+def test_namespace_switch_without_a_block_is_not_undone_by_later_blocks():
+    ServiceContainer("prod")
+    with ServiceContainer() as s:
+        pass
+    assert s.namespace == "prod"
+    with ServiceContainer("debug"):
+        assert s.namespace == "debug"
+    assert s.namespace == "prod"
+
+
+def test_namespace_switch_without_a_block_applies_to_other_threads():
+    seen = []
+    ServiceContainer(namespace="prod")
+    thread = threading.Thread(target=lambda: seen.append(ServiceContainer().namespace))
+    thread.start()
+    thread.join()
+    assert seen == ["prod"]
+
+
+def test_set_namespace_wins_over_namespace_switches():
+    sc = ServiceContainer()
+    ServiceContainer("prod")
+    sc.set_namespace("test")
+    assert sc.namespace == "test"
+    with ServiceContainer("prod") as s:
+        s.set_namespace("debug")
+        assert s.namespace == "debug"
+
+
 def test_resolving_namespaces():
     s = ServiceContainer()
-    s.clear()
     s.register(TheTalkingProtocol, Teacher())
     s.register(TheTalkingProtocol, Speaker(), namespace="test")
-    if person := ServiceContainer().resolve(TheTalkingProtocol):
+    if person := s.resolve(TheTalkingProtocol):
         assert (
             person.speak(sentence="The dog sits on a mat")
             == "The teacher screams 'The dog sits on a mat'."
         )
     with ServiceContainer("test") as s2:
-        if person := ServiceContainer().resolve(TheTalkingProtocol):
+        if person := s.resolve(TheTalkingProtocol):
             assert (
                 person.speak(sentence="The dog sits on a mat")
                 == "The speaker says 'The dog sits on a mat'."
             )
 
 
-def test_registration_with_kwargs():
-    ServiceContainer().clear()
+def test_scoped_namespaces():
+    sc = ServiceContainer()
+    teacher = Teacher()
+    speaker = Speaker()
+    sc.register(TheTalkingProtocol, teacher)
+    sc.register(TheTalkingProtocol, speaker, namespace="test")
+    with sc.scoped("test"):
+        assert sc.namespace == "test"
+        assert sc.resolve(TheTalkingProtocol) is speaker
+        with sc.scoped("default"):
+            assert sc.resolve(TheTalkingProtocol) is teacher
+        assert sc.resolve(TheTalkingProtocol) is speaker
+    assert sc.resolve(TheTalkingProtocol) is teacher
+
 
+def test_registration_with_kwargs():
     @ServiceRegistration(TheTalkingProtocol).with_arguments(
         ServiceArgument(
             **{"joke": "A barber, a developer and a mechanic walks into a bar"}
@@ -135,8 +187,6 @@ def test_registration_with_kwargs():
 
 
 def test_registration_with_kwargs_and_namespace():
-    ServiceContainer().clear()
-
     @ServiceRegistration(TheTalkingProtocol, namespace="jokes").with_arguments(
         ServiceArgument(
             **{"joke": "A barber, a developer and a mechanic walks into a bar"}
@@ -157,11 +207,6 @@ def test_registration_with_kwargs_and_namespace():
 
 
 def test_registration_with_same_instance_different_namespace():
-    ServiceContainer().clear()
-
-    class LoggingBase(Protocol):
-        def log(self, msg: str) -> None: ...
-
     @ServiceRegistration(LoggingBase)
     class LoggingCritical:
         def log(self, msg: str) -> Tuple[str, str]:
@@ -172,21 +217,17 @@ def test_registration_with_same_instance_different_namespace():
         def log(self, msg: str) -> Tuple[str, str]:
             return ("DEBUG", msg)
 
-    if logger := ServiceContainer().resolve(LoggingBase):
+    sc = ServiceContainer()
+    if logger := sc.resolve(LoggingBase):
         level, _ = logger.log(msg="A critical message")
         assert level == "CRITICAL"
 
-    if logger := ServiceContainer().resolve(LoggingBase, "debug"):
+    if logger := sc.resolve(LoggingBase, "debug"):
         level, _ = logger.log(msg="A critical message")
         assert level == "DEBUG"
 
 
 def test_registration_with_same_instance_custom_func():
-    ServiceContainer().clear()
-
-    class FancyLoggingBase(Protocol):
-        def log(self, msg: str, func: Callable[[str], str]) -> str: ...
-
     class LoggingTakingFunc:
         def __init__(self, func: Callable[[str], str]) -> None:
             self.func = func
@@ -200,15 +241,14 @@ def test_registration_with_same_instance_custom_func():
     def log_debug(msg: str) -> str:
         return f"DEBUG: {msg}"
 
-    ServiceContainer().register(FancyLoggingBase, LoggingTakingFunc(func=log_critical))
-    ServiceContainer().register(
-        FancyLoggingBase, LoggingTakingFunc(func=log_debug), namespace="debug"
-    )
+    sc = ServiceContainer()
+    sc.register(FancyLoggingBase, LoggingTakingFunc(func=log_critical))
+    sc.register(FancyLoggingBase, LoggingTakingFunc(func=log_debug), namespace="debug")
 
-    if critical_logger := ServiceContainer().resolve(FancyLoggingBase):
+    if critical_logger := sc.resolve(FancyLoggingBase):
         assert "CRITICAL" in critical_logger.log(msg="Should be critical")
 
-    if debug_logger := ServiceContainer().resolve(FancyLoggingBase, namespace="debug"):
+    if debug_logger := sc.resolve(FancyLoggingBase, namespace="debug"):
         assert "DEBUG" in debug_logger.log(msg="Should be debug")
 
     # Simulate Django settings for test and prod
@@ -219,24 +259,19 @@ def test_registration_with_same_instance_custom_func():
         DEBUG = False
 
     settings = test_settings()
-    if clueless_logger := ServiceContainer().resolve(
+    if clueless_logger := sc.resolve(
         FancyLoggingBase, namespace=settings.DEBUG and "debug"
     ):
         assert "DEBUG" in clueless_logger.log(msg="Should be debug")
 
     settings = prod_settings()
-    if clueless_logger := ServiceContainer().resolve(
+    if clueless_logger := sc.resolve(
         FancyLoggingBase, namespace=settings.DEBUG and "debug" or None
     ):
         assert "CRITICAL" in clueless_logger.log(msg="Should be critical")
 
 
 def test_namespace_resolver():
-    ServiceContainer().clear()
-
-    class FancyLoggingBase(Protocol):
-        def log(self, msg: str, func: Callable[[str], str]) -> str: ...
-
     class LoggingTakingFunc:
         def __init__(self, func: Callable[[str], str]) -> None:
             self.func = func
@@ -250,10 +285,9 @@ def test_namespace_resolver():
     def log_debug(msg: str) -> str:
         return f"DEBUG: {msg}"
 
-    ServiceContainer().register(FancyLoggingBase, LoggingTakingFunc(func=log_critical))
-    ServiceContainer().register(
-        FancyLoggingBase, LoggingTakingFunc(func=log_debug), namespace="debug"
-    )
+    sc = ServiceContainer()
+    sc.register(FancyLoggingBase, LoggingTakingFunc(func=log_critical))
+    sc.register(FancyLoggingBase, LoggingTakingFunc(func=log_debug), namespace="debug")
 
     # Simulate Django settings for test and prod
     class Settings:
@@ -264,22 +298,49 @@ def test_namespace_resolver():
     def resolve_namespace():
         return settings.DEBUG and "debug" or None
 
-    ServiceContainer().set_namespace_resolver(resolve_namespace)
-    if clueless_logger := ServiceContainer().resolve(FancyLoggingBase):
+    sc.set_namespace_resolver(resolve_namespace)
+    if clueless_logger := sc.resolve(FancyLoggingBase):
         assert "DEBUG" in clueless_logger.log(msg="Should be debug")
 
     settings.DEBUG = False
-    if clueless_logger := ServiceContainer().resolve(FancyLoggingBase):
+    if clueless_logger := sc.resolve(FancyLoggingBase):
         assert "CRITICAL" in clueless_logger.log(msg="Should be critical")
 
 
-def test_wrapper():
-    ServiceContainer().clear()
+def test_cached_namespace_resolver_per_request():
+    class Logging:
+        def __init__(self, level: str) -> None:
+            self.level = level
 
-    class FancyLoggingBase(Protocol):
-        def log(self, msg: str, func: Callable[[str], str]) -> str: ...
+        def log(self, msg: str) -> str:
+            return f"{self.level}: {msg}"
+
+    sc = ServiceContainer()
+    sc.register(LoggingBase, Logging("CRITICAL"))
+    sc.register(LoggingBase, Logging("DEBUG"), namespace="debug")
+
+    class Settings:
+        DEBUG = True
 
+    settings = Settings()
+    sc.set_namespace_resolver(lambda: settings.DEBUG and "debug" or None, cache=True)
+    if clueless_logger := sc.resolve(LoggingBase):
+        assert "DEBUG" in clueless_logger.log(msg="Should be debug")
+
+    # The cached namespace is kept until the next request boundary
+    settings.DEBUG = False
+    if clueless_logger := sc.resolve(LoggingBase):
+        assert "DEBUG" in clueless_logger.log(msg="Still debug")
+
+    sc.bump_resolver_epoch()
+    if clueless_logger := sc.resolve(LoggingBase):
+        assert "CRITICAL" in clueless_logger.log(msg="Should be critical")
+
+
+def test_wrapper():
     class ExtraArguments(ServiceArgument):
+        __slots__ = ()
+
         def unwrap(self):
             self.kwargs.update({"name": "Thomas"})
             return super().unwrap()
@@ -302,83 +363,141 @@ def test_wrapper():
 
 
 def test_duplicate_registration():
-    ServiceContainer().clear()
-    ServiceContainer().setconfig({"raise_exception_on_double_registrations": True})
-    ServiceContainer().register(TheTalkingProtocol, Teacher())
+    sc = ServiceContainer()
+    sc.setconfig({"raise_exception_on_double_registrations": True})
+    sc.register(TheTalkingProtocol, Teacher())
     with pytest.raises(ServiceAlreadyRegistered):
-        ServiceContainer().register(TheTalkingProtocol, Teacher())
+        sc.register(TheTalkingProtocol, Teacher())
+
+
+def test_duplicate_registration_does_not_construct():
+    constructed = []
+
+    class Tracked:
+        def __init__(self):
+            constructed.append(self)
+
+        def speak(self, sentence) -> str:
+            return sentence
+
+    sc = ServiceContainer(lazy_construction=False)
+    sc.setconfig({"raise_exception_on_double_registrations": True})
+    sc.register(TheTalkingProtocol, Tracked)
+    with pytest.raises(ServiceAlreadyRegistered):
+        sc.register(TheTalkingProtocol, Tracked)
+    assert len(constructed) == 1
 
 
 def test_setconfig_invalid_settings():
-    ServiceContainer().clear()
     with ServiceContainer() as sc:
         sc.setconfig({"instance": True})
         sc.register(TheTalkingProtocol, Teacher())
 
 
 def test_setconfig_valid_settings_v2():
-    ServiceContainer().clear()
-    ServiceContainer().setconfig({"default_namespace": "demo"})
-    ServiceContainer().register(TheTalkingProtocol, Teacher())
-    ServiceContainer().setconfig({"default_namespace": "default"})
+    sc = ServiceContainer()
+    sc.setconfig({"default_namespace": "demo"})
+    sc.register(TheTalkingProtocol, Teacher())
+    sc.setconfig({"default_namespace": "default"})
+
+
+def test_module_level_container_is_the_singleton():
+    assert container is ServiceContainer()
+
+
+def test_container_rejects_unknown_attributes():
+    with pytest.raises(AttributeError):
+        ServiceContainer().unknown_setting = True  # type: ignore
 
 
 def test_replace_registration():
-    ServiceContainer().clear()
-    ServiceContainer().register(TheTalkingProtocol, Teacher())
-    ServiceContainer().replace(TheTalkingProtocol, Substitute())
-    if srv := ServiceContainer().resolve(TheTalkingProtocol):
+    sc = ServiceContainer()
+    sc.register(TheTalkingProtocol, Teacher())
+    sc.replace(TheTalkingProtocol, Substitute())
+    if srv := sc.resolve(TheTalkingProtocol):
         assert srv.speak("Dog") == "The substitute mumbles 'Dog'."
 
 
+def test_replace_and_remove_after_resolve():
+    sc = ServiceContainer()
+    teacher = Teacher()
+    sc.register(TheTalkingProtocol, teacher)
+    assert sc.resolve(TheTalkingProtocol) is teacher
+    assert sc.resolve(TheTalkingProtocol) is teacher
+    sc.replace(TheTalkingProtocol, Substitute())
+    assert isinstance(sc.resolve(TheTalkingProtocol), Substitute)
+    sc.remove(TheTalkingProtocol)
+    assert sc.resolve(TheTalkingProtocol) is None
+
+
 def test_remove_registration():
-    ServiceContainer().clear()
-    ServiceContainer().register(TheTalkingProtocol, Teacher())
-    ServiceContainer().remove(TheTalkingProtocol)
-    assert ServiceContainer().resolve(TheTalkingProtocol) == None
+    sc = ServiceContainer()
+    sc.register(TheTalkingProtocol, Teacher())
+    sc.remove(TheTalkingProtocol)
+    assert sc.resolve(TheTalkingProtocol) == None
 
 
 def test_namespace_resolver_namespace_property():
     def resolver():
         return "test"
 
-    ServiceContainer().clear()
-    ServiceContainer().register(TheTalkingProtocol, Teacher(), namespace="test")
-    ServiceContainer().set_namespace_resolver(resolver)
-    assert isinstance(ServiceContainer().resolve(TheTalkingProtocol), Teacher)
-    assert ServiceContainer().namespace == "test"
+    sc = ServiceContainer()
+    teacher = Teacher()
+    sc.register(TheTalkingProtocol, teacher, namespace="test")
+    sc.set_namespace_resolver(resolver)
+    assert sc.resolve(TheTalkingProtocol) is teacher
+    assert sc.namespace == "test"
 
 
 def test_clear_namespace_resolver():
     def resolver():
         return "test"
 
-    ServiceContainer().clear()
-    ServiceContainer().register(TheTalkingProtocol, Teacher(), namespace="test")
-    ServiceContainer().set_namespace_resolver(resolver)
-    assert isinstance(ServiceContainer().resolve(TheTalkingProtocol), Teacher)
-    assert ServiceContainer().namespace == "test"
-    ServiceContainer().clear_namespace_resolver()
-    assert ServiceContainer().namespace == "default"
+    sc = ServiceContainer()
+    teacher = Teacher()
+    sc.register(TheTalkingProtocol, teacher, namespace="test")
+    sc.set_namespace_resolver(resolver)
+    assert sc.resolve(TheTalkingProtocol) is teacher
+    assert sc.namespace == "test"
+    sc.clear_namespace_resolver()
+    assert sc.namespace == "default"
 
 
-def test_remove_registration_with_instance():
-    ServiceContainer().clear()
+def test_cached_namespace_resolver():
+    calls = []
 
+    def resolver():
+        calls.append(1)
+        return "test"
+
+    sc = ServiceContainer()
+    teacher = Teacher()
+    sc.register(TheTalkingProtocol, teacher, namespace="test")
+    sc.set_namespace_resolver(resolver, cache=True)
+    assert sc.resolve(TheTalkingProtocol) is teacher
+    assert sc.resolve(TheTalkingProtocol) is teacher
+    assert sc.namespace == "test"
+    assert len(calls) == 1
+    sc.bump_resolver_epoch()
+    assert sc.namespace == "test"
+    assert len(calls) == 2
+    sc.clear_namespace_resolver()
+
+
+def test_remove_registration_with_instance():
     class A:
         pass
 
     class B(A):
         pass
 
-    ServiceContainer().register(A, B())
-    ServiceContainer().remove(A())
-    assert ServiceContainer().resolve(A) == None
+    sc = ServiceContainer()
+    sc.register(A, B())
+    sc.remove(A())
+    assert sc.resolve(A) == None
 
 
 def test_wrapper_service_base():
-    ServiceContainer().clear()
-
     class IA(Protocol):
         def speak(self): ...
 
@@ -389,16 +508,13 @@ def test_wrapper_service_base():
         def speak(self):
             return f"Here are kwargs: {self.kwargs}"
 
-    ServiceContainer().register(
-        IA, ServiceArgument(some="foobar", variable="something").for_service(A)
-    )
-    if res := ServiceContainer().resolve(IA):
+    sc = ServiceContainer()
+    sc.register(IA, ServiceArgument(some="foobar", variable="something").for_service(A))
+    if res := sc.resolve(IA):
         assert res.speak() != None
 
 
 def test_wrapper_service_base_with_dependencies():
-    ServiceContainer().clear()
-
     class IB(Protocol):
         def howl(self): ...
 
@@ -417,12 +533,47 @@ def test_wrapper_service_base_with_dependencies():
         def speak(self) -> str:
             return f"Here are kwargs: {self.kwargs} and a word from B: {self.b.howl()}"
 
-    ServiceContainer().register(IB, B)
-    ServiceContainer().register(
-        IA, ServiceArgument(some="foobar", variable="something").for_service(A)
-    )
-    if res := ServiceContainer().resolve(IA):
+    sc = ServiceContainer()
+    sc.register(IB, B)
+    sc.register(IA, ServiceArgument(some="foobar", variable="something").for_service(A))
+    if res := sc.resolve(IA):
         spoken: str = res.speak()
         # Here we test to see if both the foobar supplied as extra argument
         # and the data from the required service IB are in the response
         assert "foobar" in spoken and "YAHOO" in spoken
+
+
+def test_register_cached_shares_instances():
+    class LoggingTakingFunc:
+        def __init__(self, func: Callable[[str], str]) -> None:
+            self.func = func
+
+        def log(self, msg: str) -> str:
+            return self.func(msg)
+
+    def log_critical(msg: str) -> str:
+        return f"CRITICAL: {msg}"
+
+    sc = ServiceContainer()
+    sc.register_cached(LoggingBase, LoggingTakingFunc, func=log_critical)
+    sc.register_cached(
+        FancyLoggingBase, LoggingTakingFunc, namespace="debug", func=log_critical
+    )
+    logger = sc.resolve(LoggingBase)
+    assert logger.log("Hi") == "CRITICAL: Hi"
+    assert sc.resolve(FancyLoggingBase, namespace="debug") is logger
+
+
+def test_resolver_for():
+    sc = ServiceContainer()
+    teacher = Teacher()
+    sc.register(TheTalkingProtocol, teacher)
+    sc.register(TheTalkingProtocol, Speaker, namespace="test")
+    get_teacher = sc.resolver_for(TheTalkingProtocol)
+    get_speaker = sc.resolver_for(TheTalkingProtocol, namespace="test")
+    assert get_teacher() is teacher
+    assert get_teacher() is teacher
+    assert get_speaker() is get_speaker()
+    assert isinstance(get_speaker(), Speaker)
+    sc.replace(TheTalkingProtocol, Substitute())
+    assert isinstance(get_teacher(), Substitute)
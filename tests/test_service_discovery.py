@@ -0,0 +1,123 @@
+import importlib
+import logging
+import sys
+from pathlib import Path
+
+import pytest
+from serpentariumcore import ServiceDiscovery
+
+
+def write_package(root: Path, name: str, modules: dict[str, str]) -> Path:
+    package = root / name
+    package.mkdir()
+    (package / "__init__.py").write_text("order = []\n")
+    for module_name, source in modules.items():
+        (package / f"{module_name}.py").write_text(source)
+    return package
+
+
+def discovery_order(package: Path) -> list[str]:
+    return [
+        f"{package.name}.{unit.stem}"
+        for unit in package.glob("**/*.py")
+        if not unit.name.startswith("test_") and not unit.name.startswith("__")
+    ]
+
+
+@pytest.fixture
+def packages(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    before = set(sys.modules)
+    yield tmp_path
+    for name in set(sys.modules) - before:
+        del sys.modules[name]
+
+
+def test_discovery_executes_modules_in_discovery_order(packages):
+    source = "from . import order\norder.append(__name__)\n"
+    package = write_package(
+        packages, "ordered", {name: source for name in ("alpha", "beta", "gamma")}
+    )
+    module = importlib.import_module("ordered")
+    ServiceDiscovery(verbose=False).discover(module)
+    assert module.order == discovery_order(package)
+
+
+def test_discovery_removes_failing_modules(packages, caplog):
+    write_package(
+        packages,
+        "failing",
+        {"broken": "raise RuntimeError('boom')\n", "working": "value = 42\n"},
+    )
+    module = importlib.import_module("failing")
+    with caplog.at_level(logging.INFO, logger="serpentariumcore"):
+        ServiceDiscovery(verbose=False).discover(module)
+    assert "failing.broken" not in sys.modules
+    assert sys.modules["failing.working"].value == 42
+    assert "Error importing" in caplog.text and "boom" in caplog.text
+
+
+def test_discovery_supports_relative_imports(packages):
+    write_package(
+        packages,
+        "relative",
+        {
+            "base": "from . import order\norder.append(__name__)\nvalue = 1\n",
+            "derived": "from .base import value\nvalue = value + 1\n",
+        },
+    )
+    module = importlib.import_module("relative")
+    ServiceDiscovery(verbose=False).discover(module)
+    assert sys.modules["relative.derived"].value == 2
+    # The imported module is executed once, not again by discovery
+    assert module.order == ["relative.base"]
+
+
+def test_nested_discovery_returns_without_reentering(packages):
+    write_package(packages, "inner", {"service": "value = 1\n"})
+    write_package(
+        packages,
+        "outer",
+        {
+            "nested": (
+                "import inner\n"
+                "from serpentariumcore import ServiceDiscovery\n"
+                "ServiceDiscovery(verbose=False).discover(inner)\n"
+            )
+        },
+    )
+    module = importlib.import_module("outer")
+    ServiceDiscovery(verbose=False).discover(module)
+    assert "outer.nested" in sys.modules
+    assert "inner.service" not in sys.modules
+
+
+def test_discovered_modules_are_bound_on_their_package(packages):
+    package = write_package(packages, "bound", {"service": "value = 1\n"})
+    (package / "sub").mkdir()
+    (package / "sub" / "__init__.py").write_text("")
+    (package / "sub" / "nested.py").write_text("value = 2\n")
+    ServiceDiscovery(verbose=False).discover(importlib.import_module("bound"))
+    import bound.service
+    import bound.sub.nested
+
+    assert bound.service.value == 1
+    assert bound.sub.nested.value == 2
+
+
+def test_discovery_of_top_level_modules_does_not_register_them(packages, monkeypatch):
+    import queue
+
+    root = packages / "scripts"
+    root.mkdir()
+    monkeypatch.syspath_prepend(str(root))
+    (root / "app.py").write_text("order = []\n")
+    source = "import app\napp.order.append({!r})\n"
+    for name in ("mailer", "queue"):
+        (root / f"{name}.py").write_text(source.format(name))
+    module = importlib.import_module("app")
+    ServiceDiscovery(verbose=False).discover(module)
+    # A bare file name must not shadow or skip an unrelated top-level module
+    assert sorted(module.order) == ["mailer", "queue"]
+    assert "mailer" not in sys.modules
+    assert sys.modules["queue"] is queue
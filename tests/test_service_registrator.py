@@ -4,14 +4,14 @@ import pytest
 from serpentariumcore import (
     ConstructionFailed,
     MissingRequirements,
+    ServiceArgument,
     ServiceContainer,
+    ServiceOf,
     ServiceRegistration,
 )
 
 
 def _test_service_registration_lazy_construction():
-    ServiceContainer().clear()
-
     class IA(Protocol):
         def go_a(self): ...
 
@@ -55,7 +55,6 @@ def _test_service_registration_lazy_construction():
 
 
 def test_service_registration_without_lazy_construction_crashes():
-    ServiceContainer().clear()
     ServiceContainer(lazy_construction=False)
 
     class IA(Protocol):
@@ -77,3 +76,66 @@ def test_service_registration_without_lazy_construction_crashes():
             def __init__(self, a: IA, b: IB):
                 self.a: IA = a
                 self.b: IB = b
+
+
+def test_service_registration_with_arguments_is_memoized():
+    class ICounter(Protocol):
+        def count(self): ...
+
+    @ServiceRegistration(ICounter).with_arguments(ServiceArgument(start=10))
+    class Counter:
+        def __init__(self, start=0):
+            self.start = start
+
+        def count(self):
+            return self.start
+
+    sc = ServiceContainer()
+    first = sc.resolve(ICounter)
+    assert first.count() == 10
+    assert sc.resolve(ICounter) is first
+
+
+def test_transient_service_registration_constructs_on_every_resolve():
+    class ICounter(Protocol):
+        def count(self): ...
+
+    @ServiceRegistration(ICounter, transient=True)
+    class Counter:
+        def count(self):
+            return 0
+
+    sc = ServiceContainer()
+    first = sc.resolve(ICounter)
+    assert isinstance(first, Counter)
+    assert sc.resolve(ICounter) is not first
+
+
+def test_service_of_registers_subclass():
+    class ISpeaker(Protocol):
+        def speak(self): ...
+
+    class IListener(Protocol):
+        def listen(self): ...
+
+    class Speaker(ServiceOf[ISpeaker]):
+        def speak(self):
+            return "Hello"
+
+    class Listener(ServiceOf[IListener], namespace="test"):
+        def __init__(self, speaker: ISpeaker):
+            self.speaker = speaker
+
+        def listen(self):
+            return self.speaker.speak()
+
+    class LoudSpeaker(Speaker):
+        def speak(self):
+            return "HELLO"
+
+    sc = ServiceContainer()
+    assert isinstance(sc.resolve(ISpeaker), Speaker)
+    assert not isinstance(sc.resolve(ISpeaker), LoudSpeaker)
+    assert sc.resolve(IListener) is None
+    sc.register(ISpeaker, Speaker, namespace="test")
+    assert sc.resolve(IListener, namespace="test").listen() == "Hello"